@@ -21,6 +21,9 @@ from win32com import client
 import win32api
 import pathlib
 from magnetModuleList import *
+from surveyDataset import SurveyDataset
+from surveyPreflight import preflight_check, preflight_batch
+from reportArchive import archive_report
 
 # In[2]:
 
@@ -238,26 +241,15 @@ def append_df_to_excel(
 # In[4]:
 
 
-def read_csv(filename, col_names = False):
+def array_frame(array, columns):
     
-    if col_names:
-        df = pd.read_csv(filename, index_col=0)
-    else:
-        df = pd.read_csv(filename, names=['Key','Value'], index_col=0)
+    # columns[0] labels the name field, the rest label the numeric fields in order
+    df = pd.DataFrame({col: array[field] for col, field in zip(columns[1:], array.dtype.names[1:])},
+                      index=pd.Index(array['name'], name=columns[0]))
     
     return df
 
 
-# In[5]:
-
-
-def extract_csv_data(dataframe, index_names, column_names=['Value']):
-    
-    values = [[dataframe.loc[index][column] for column in column_names] for index in index_names]
-    
-    return values
-
-
 # In[6]:
 
 
@@ -532,9 +524,19 @@ def extract_magnet_list(module_name):
 # In[19]:
 
 #@widget_out.capture()
-def generate_excel_report(module_name):
+def generate_excel_report(module_name, dataset=None):
     
     print("Executing program...")
+    # generate_excel_reports passes the dataset its pre-flight pass already parsed
+    if dataset is None:
+        problems, dataset = preflight_check(module_name, MAGNETMODULES)
+    else:
+        problems = []
+    if problems:
+        print(Fore.RED + "Pre-flight check failed, no report created:" + Style.RESET_ALL)
+        for problem in problems:
+            print(Fore.RED + "    " + problem + Style.RESET_ALL)
+        return False
     filename_report = module_name + '/Report ' + module_name + ' Assembly Survey.xlsx'
     filename_report = os.path.abspath(filename_report)
     shutil.copy('Form_DLM_SurveyReport.xlsx', filename_report)
@@ -543,25 +545,19 @@ def generate_excel_report(module_name):
     regular = Side(border_style="thin", color="00D3D3D3")
     thick = Side(border_style="thick", color="00000000")
     
-    df = read_csv(module_name+'/INFO.csv')
-    data = extract_csv_data(df,['Survey Date:','Surveyor(s):','Instrument s/n:','SA Version:','SA Filename:'])
-    data[4][0] = data[4][0][data[4][0].rfind('\\')+1:]
-    data = [item[0] for item in data]
+    data = dataset.info.values()
+    data[4] = data[4][data[4].rfind('\\')+1:]
     data.append(date.today().strftime("%B %d, %Y"))
     write_excel_col(filename_report,'Alignment Summary',data,'C3')
     write_excel_col(filename_report,'Alignment Summary',[module_name],'B1')
     
-    df = read_csv(module_name+'/CENTERS.csv',col_names=True)
+    df = array_frame(dataset.centers, dataset.centers_columns)
     append_df_to_excel(filename_report,df,sheet_name="Alignment Summary",startcol=1,startrow=24)
     
-    try:
-        df = read_csv(module_name+'/M1_VERTEX.csv',col_names=True)
-        M1_data = []
-        M1_data.append(str(df.index.name))
-        for i in df.columns:
-            M1_data.append(float(i))
+    if dataset.m1_vertex is not None and len(dataset.m1_vertex) > 0:
+        M1_data = dataset.m1_vertex[0].tolist()
         write_excel_row(filename_report,'Alignment Summary',M1_data,'B41')
-    except:
+    else:
         print("M1 data excluded...")
     
     name, url, serial = extract_magnet_list(module_name)
@@ -619,15 +615,28 @@ def generate_excel_report(module_name):
     savefile_to_pdf(filename_report)
     print("Alignment summary tab exported to PDF...")
 
-    archive_filename = 'Archive\Report ' + module_name + ' Assembly Survey'
-    os.system('copy \"' + module_name + '\Report ' + module_name + ' Assembly Survey.xlsx' + '\" \"' + archive_filename + '.xlsx' + '\"')
-    os.system('copy \"' + module_name + '\Report ' + module_name + ' Assembly Survey.pdf' + '\" \"' + archive_filename + '.pdf' + '\"')
-    print("Report saved to archive folder...")
+    artifacts = [filename for filename in [filename_report, filename_report[:-5] + '.pdf'] if os.path.isfile(filename)]
+    entry = archive_report(module_name, artifacts)
+    print("Report saved to archive folder (version " + str(entry['version']) + ")...")
 
     data = extract_RMS(filename_report,'Alignment Summary','C36:E36')
     log_entry(filename_report,data)
     print("Entry created in log sheet...")
     print("Done!")
+    return True
+
+def generate_excel_reports(module_names):
+
+    # reject doomed directories up front, concurrently, before any Excel work starts
+    results = preflight_batch(module_names, MAGNETMODULES)
+    for name, (problems, dataset) in results.items():
+        if problems:
+            print(Fore.RED + name + ": skipped, " + str(len(problems)) + " pre-flight problem(s)" + Style.RESET_ALL)
+            for problem in problems:
+                print(Fore.RED + "    " + problem + Style.RESET_ALL)
+    created = [name for name, (problems, dataset) in results.items() if not problems and generate_excel_report(name, dataset)]
+
+    return created
 
 # In[18]:
 
@@ -669,4 +678,188 @@ def savefile_to_pdf(excel_file):
 module_name = widgets.Text(value='DLM#-1###', description='Module name:', disabled=False,
                                   style = {'description_width': 'initial'}, layout=widgets.Layout(width="auto", height="auto"))
 button = widgets.Button(description="Create assembly survey report", layout=widgets.Layout(width="auto", height="auto"))
-button.on_click(on_button_clicked)
\ No newline at end of file
+button.on_click(on_button_clicked)
+
+# In[21]:
+
+def magnet_key(name):
+
+    # DA23_AQ1_0 -> AQ1, so the same magnet lines up even if the surveyor changes the suffix
+    parts = str(name).split('_')
+    if len(parts) > 2:
+        return parts[1]
+    return str(name)
+
+# In[22]:
+
+def check_unique(index, filename):
+
+    duplicates = sorted(set(index[index.duplicated()]))
+    if duplicates:
+        raise ValueError(filename + ": duplicate name(s) " + ", ".join(duplicates))
+
+def centers_delta(df_before, df_after):
+
+    before = df_before.set_axis([magnet_key(i) for i in df_before.index])
+    after = df_after.set_axis([magnet_key(i) for i in df_after.index])
+    # two rows for one magnet (e.g. DA23_AQ1_0 and DA23_AQ1_V) can only be told apart by full name
+    if before.index.has_duplicates or after.index.has_duplicates:
+        check_unique(df_before.index, 'baseline CENTERS')
+        check_unique(df_after.index, 'resurvey CENTERS')
+        before = df_before
+        after = df_after
+    common = after.index[after.index.isin(before.index)]
+
+    delta = after.loc[common] - before.loc[common, after.columns]
+    delta.columns = ['d' + col for col in after.columns]
+    delta['dR (m)'] = np.linalg.norm(delta.iloc[:, 0:3].to_numpy(), axis=1)
+    delta.index.name = 'Magnet'
+
+    return delta
+
+def fiducials_delta(df_before, df_after, tolerance=0.005):
+
+    check_unique(df_before.index, 'baseline FIDUCIALS')
+    check_unique(df_after.index, 'resurvey FIDUCIALS')
+    after_names = list(df_after.index[df_after.index.isin(df_before.index)])
+    before_names = list(after_names)
+    method = ['Name']*len(after_names)
+
+    # points renamed between surveys are paired with their nearest unmatched neighbour
+    rest_after = df_after.index[~df_after.index.isin(df_before.index)]
+    rest_before = df_before.index[~df_before.index.isin(df_after.index)]
+    if len(rest_after) > 0 and len(rest_before) > 0:
+        a = df_after.loc[rest_after].to_numpy()
+        b = df_before.loc[rest_before].to_numpy()
+        dist = np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+        nearest = dist.argmin(axis=1)
+        nearest_dist = dist[np.arange(len(a)), nearest]
+        order = np.argsort(nearest_dist)
+        _, first = np.unique(nearest[order], return_index=True)
+        keep = np.sort(order[first])
+        keep = keep[nearest_dist[keep] <= tolerance]
+        after_names += list(rest_after[keep])
+        before_names += list(rest_before[nearest[keep]])
+        method += ['Nearest']*len(keep)
+
+    values = df_after.loc[after_names].to_numpy() - df_before.loc[before_names].to_numpy()
+    delta = pd.DataFrame(values, index=pd.Index(after_names, name='Point Name'),
+                         columns=['d' + col for col in df_after.columns])
+    delta['dR (m)'] = np.linalg.norm(values, axis=1)
+    delta.insert(0, 'Baseline Point', before_names)
+    delta.insert(1, 'Match', method)
+
+    return delta
+
+def delta_summary(delta):
+
+    numeric = delta.select_dtypes(include=np.number)
+    summary = pd.DataFrame({'Mean': numeric.mean(),
+                            'RMS': np.sqrt((numeric**2).mean()),
+                            'Max |d|': numeric.abs().max()}).T
+    summary.index.name = 'Statistic'
+
+    return summary
+
+# In[23]:
+
+def magnet_frame(dataset):
+
+    # the M1 dipole vertex is surveyed separately from CENTERS but is compared like any other magnet
+    poses = dataset.centers
+    if dataset.m1_vertex is not None:
+        poses = np.concatenate([poses, dataset.m1_vertex])
+
+    return array_frame(poses, dataset.centers_columns)
+
+def write_delta_sheet(workbook, sheet_name, tables):
+
+    # the sheet is rebuilt on every run so a shorter resurvey leaves no stale rows behind
+    wb = load_workbook(workbook)
+    if sheet_name in wb.sheetnames:
+        del wb[sheet_name]
+    ws = wb.create_sheet(sheet_name)
+
+    row = 1
+    for title, df in tables:
+        ws.cell(row, 1).value = title
+        ws.cell(row, 1).font = Font(name="Calibri", size=11, bold=True)
+        header = [df.index.name] + list(df.columns)
+        for col, value in enumerate(header, 1):
+            ws.cell(row+1, col).value = value
+            ws.cell(row+1, col).font = Font(name="Calibri", size=11, bold=True)
+        for i, (name, values) in enumerate(zip(df.index, df.itertuples(index=False)), row+2):
+            ws.cell(i, 1).value = str(name)
+            for col, value in enumerate(values, 2):
+                ws.cell(i, col).value = value.item() if isinstance(value, np.generic) else value
+                if isinstance(value, (float, np.floating)):
+                    ws.cell(i, col).number_format = '0.000000'
+        row += len(df) + 3
+    wb.save(workbook)
+
+def add_resurvey_delta(module_name, baseline_dir):
+
+    print("Comparing " + module_name + " against " + baseline_dir + "...")
+    filename_report = module_name + '/Report ' + module_name + ' Assembly Survey.xlsx'
+    filename_report = os.path.abspath(filename_report)
+    sheet_name = 'Resurvey Delta'
+    if not os.path.isfile(filename_report):
+        print(Fore.RED + "No report found for " + module_name + ", create the assembly survey report first." + Style.RESET_ALL)
+        return None
+
+    before = SurveyDataset(baseline_dir)
+    after = SurveyDataset(module_name)
+    fiducial_columns = ['Point Name','X (m)','Y (m)','Z (m)']
+
+    magnets_before = magnet_frame(before)
+    magnets_after = magnet_frame(after)
+    centers = centers_delta(magnets_before, magnets_after)
+    fiducials = fiducials_delta(array_frame(before.fiducials, fiducial_columns),
+                                array_frame(after.fiducials, fiducial_columns))
+    centers_summary = delta_summary(centers)
+    fiducials_summary = delta_summary(fiducials)
+
+    write_delta_sheet(filename_report, sheet_name,
+                      [('Magnet centers (' + module_name + ' - ' + baseline_dir + ')', centers),
+                       ('Magnet centers summary', centers_summary),
+                       ('Fiducials (' + module_name + ' - ' + baseline_dir + ')', fiducials),
+                       ('Fiducials summary', fiducials_summary)])
+    autofit_columns(filename_report,sheet_name)
+
+    unmatched = len(magnets_after) - len(centers)
+    if unmatched > 0:
+        print(Fore.RED + str(unmatched) + " magnet(s) could not be matched to the baseline survey." + Style.RESET_ALL)
+    unmatched = len(magnets_before) - len(centers)
+    if unmatched > 0:
+        print(Fore.RED + str(unmatched) + " baseline magnet(s) are missing from this survey." + Style.RESET_ALL)
+    unmatched = len(after.fiducials) - len(fiducials)
+    if unmatched > 0:
+        print(Fore.RED + str(unmatched) + " fiducial(s) could not be matched to the baseline survey." + Style.RESET_ALL)
+    print(centers_summary.to_string())
+    print("Resurvey Delta tab complete...")
+
+    # the delta sheet changes the workbook, so record it as a new archived version
+    artifacts = [filename for filename in [filename_report, filename_report[:-5] + '.pdf'] if os.path.isfile(filename)]
+    entry = archive_report(module_name, artifacts)
+    print("Report saved to archive folder (version " + str(entry['version']) + ")...")
+
+    return centers, fiducials
+
+# In[24]:
+
+# Resurvey diff mode: enter the module name above and the directory of the earlier
+# survey of the same module here, e.g. DLMB-1040_pre-shim. The delta sheet is added to
+# the existing report; creating the report again starts from the template and drops it.
+@widget_out.capture()
+def on_resurvey_clicked(b):
+
+    clear_output(wait=False)
+    if len(module_name.value) == 0 or len(baseline_name.value) == 0:
+        print(Fore.RED + "Please enter the module name and the baseline survey directory." + Style.RESET_ALL)
+    else:
+        add_resurvey_delta(module_name.value, baseline_name.value)
+
+baseline_name = widgets.Text(value='', description='Baseline survey directory:', disabled=False,
+                                  style = {'description_width': 'initial'}, layout=widgets.Layout(width="auto", height="auto"))
+resurvey_button = widgets.Button(description="Add resurvey delta to report (dropped if the report is created again)", layout=widgets.Layout(width="auto", height="auto"))
+resurvey_button.on_click(on_resurvey_clicked)
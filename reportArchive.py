@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+""" Script keeps the archive of generated survey reports.   Report files are
+stored once under Archive/objects by the SHA-256 of their canonical contents
+(save timestamps stripped, see content_digest) and each
+module keeps its version history in Archive/history/<module>.json as a list
+of references, so re-archiving an unchanged report writes nothing """
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zipfile
+from datetime import datetime
+
+ARCHIVE_DIR = 'Archive'
+CHUNK_SIZE = 1 << 20
+
+# openpyxl rewrites docProps/core.xml (modified time) on every save
+XLSX_VOLATILE = ['docProps/core.xml']
+# Excel's PDF export stamps the info dictionary, trailer ID and XMP metadata
+PDF_VOLATILE = re.compile(rb'/(?:CreationDate|ModDate)\s*\([^)]*\)'
+                          rb'|/ID\s*\[[^\]]*\]'
+                          rb'|<(xmp:(?:CreateDate|ModifyDate|MetadataDate)|xmpMM:(?:DocumentID|InstanceID))>[^<]*</\1>'
+                          rb'|(?:xmp:(?:CreateDate|ModifyDate|MetadataDate)|xmpMM:(?:DocumentID|InstanceID))="[^"]*"')
+
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_digest(filename):
+
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def content_digest(filename):
+
+    # two saves of the same report differ only in timestamps, so hash what is left without them
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        sha = hashlib.sha256()
+        with zipfile.ZipFile(filename) as zf:
+            for name in sorted(zf.namelist()):
+                if name in XLSX_VOLATILE:
+                    continue
+                sha.update(name.encode() + b'\0')
+                sha.update(hashlib.sha256(zf.read(name)).digest())
+        return sha.hexdigest()
+    if extension == '.pdf':
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(PDF_VOLATILE.sub(b'', f.read())).hexdigest()
+    return file_digest(filename)
+
+
+def atomic_write(filename, write):
+
+    # write into a temp file next to the target, then rename over it
+    directory = os.path.dirname(filename)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp, 0o666 & ~UMASK)   # mkstemp creates the file 0600
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def object_path(digest, archive_dir=ARCHIVE_DIR):
+
+    path = os.path.join(archive_dir, 'objects', digest[:2], digest)
+    if not os.path.isfile(path) and os.path.isfile(path + '.gz'):
+        return path + '.gz'
+    return path
+
+
+def store_object(filename, archive_dir=ARCHIVE_DIR):
+
+    # the first raw file seen for a digest is the one kept
+    digest = content_digest(filename)
+    path = object_path(digest, archive_dir)
+    if not os.path.isfile(path):
+        with open(filename, 'rb') as src:
+            atomic_write(path, lambda dst: shutil.copyfileobj(src, dst, CHUNK_SIZE))
+    return digest
+
+
+def history_path(module_name, archive_dir=ARCHIVE_DIR):
+
+    return os.path.join(archive_dir, 'history', module_name + '.json')
+
+
+def read_history(module_name, archive_dir=ARCHIVE_DIR):
+
+    path = history_path(module_name, archive_dir)
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def archive_report(module_name, filenames, archive_dir=ARCHIVE_DIR):
+
+    artifacts = {os.path.basename(filename): store_object(filename, archive_dir) for filename in filenames}
+    history = read_history(module_name, archive_dir)
+    if history and history[-1]['artifacts'] == artifacts:
+        return history[-1]
+
+    entry = {'version': len(history) + 1,
+             'archived': datetime.now().isoformat(timespec='seconds'),
+             'artifacts': artifacts}
+    history.append(entry)
+    data = json.dumps(history, indent=3).encode()
+    atomic_write(history_path(module_name, archive_dir), lambda f: f.write(data))
+    return entry
+
+
+def restore_report(module_name, artifact_name, destination, version=None, archive_dir=ARCHIVE_DIR):
+
+    history = read_history(module_name, archive_dir)
+    if not history:
+        raise FileNotFoundError(module_name + ": no archived reports")
+    if version is None:
+        version = len(history)
+    if not 1 <= version <= len(history):
+        raise ValueError(module_name + ": version " + str(version) + " not in archive (1 to " + str(len(history)) + ")")
+    entry = history[version - 1]
+    if artifact_name not in entry['artifacts']:
+        raise FileNotFoundError(module_name + ": version " + str(version) + " has no " + repr(artifact_name)
+                                + " (archived: " + ", ".join(sorted(entry['artifacts'])) + ")")
+    path = object_path(entry['artifacts'][artifact_name], archive_dir)
+
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as src:
+        atomic_write(os.path.abspath(destination), lambda dst: shutil.copyfileobj(src, dst, CHUNK_SIZE))
+    return destination
+
+
+def write_gzip(src, dst):
+
+    with gzip.GzipFile(fileobj=dst, mode='wb', mtime=0) as gz:
+        shutil.copyfileobj(src, gz, CHUNK_SIZE)
+
+
+def compress_old_versions(keep=1, archive_dir=ARCHIVE_DIR):
+
+    # objects still referenced by the newest [keep] versions of any module stay uncompressed
+    history_dir = os.path.join(archive_dir, 'history')
+    if not os.path.isdir(history_dir):
+        return []
+    current = set()
+    referenced = set()
+    for name in os.listdir(history_dir):
+        if name.endswith('.json'):
+            history = read_history(name[:-5], archive_dir)
+            for i, entry in enumerate(history):
+                referenced.update(entry['artifacts'].values())
+                if i >= len(history) - keep:
+                    current.update(entry['artifacts'].values())
+
+    compressed = []
+    for digest in sorted(referenced - current):
+        path = object_path(digest, archive_dir)
+        if path.endswith('.gz') or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as src:
+            atomic_write(path + '.gz', lambda dst: write_gzip(src, dst))
+        os.remove(path)
+        compressed.append(digest)
+    return compressed
+
+
+if __name__ == "__main__":
+    for module_name in sys.argv[1:]:
+        for entry in read_history(module_name):
+            print(module_name + " v" + str(entry['version']) + "  " + entry['archived'])
+            for artifact, digest in entry['artifacts'].items():
+                print("    " + digest[:12] + "  " + artifact)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+""" Module reads the survey files exported for one magnet module directory
+(INFO.csv, CENTERS.csv, M1_VERTEX.csv, FIDUCIALS.xls) in a single pass and
+keeps them as slotted records and NumPy structured arrays.   The report,
+resurvey and batch code all load modules through SurveyDataset """
+
+import csv
+import os
+import sys
+import numpy as np
+import xlrd
+
+INFO_KEYS = {}
+INFO_KEYS['Survey Date:'] = "survey_date"
+INFO_KEYS['Surveyor(s):'] = "surveyors"
+INFO_KEYS['Instrument s/n:'] = "instrument_sn"
+INFO_KEYS['SA Version:'] = "sa_version"
+INFO_KEYS['SA Filename:'] = "sa_filename"
+
+# names longer than this are rejected rather than silently truncated by numpy
+NAME_LENGTH = 32
+
+POSE_FIELDS = ["x","y","z","pitch","yaw","roll"]
+POSE_UNITS = ["m","m","m","mr","mr","mr"]
+POSE_LABELS = ["X (m)","Y (m)","Z (m)","Pitch (mr)","Yaw (mr)","Roll (mr)"]
+POSE_DTYPE = np.dtype([("name","U"+str(NAME_LENGTH))] + [(field,"f8") for field in POSE_FIELDS])
+
+POINT_FIELDS = ["x","y","z"]
+POINT_UNITS = ["m","m","m"]
+POINT_DTYPE = np.dtype([("name","U"+str(NAME_LENGTH))] + [(field,"f8") for field in POINT_FIELDS])
+
+# FIDUCIALS.xls is the SpatialAnalyzer point group export: title block in the
+# first rows, column labels on row 11, units on row 12, points from row 13
+FIDUCIALS_HEADER_ROW = 10
+FIDUCIALS_FIRST_ROW = 12
+FIDUCIALS_COLUMNS = [0,2,3,4]
+
+
+class SurveyInfo:
+
+    __slots__ = tuple(INFO_KEYS.values())
+
+    def __init__(self, survey_date, surveyors, instrument_sn, sa_version, sa_filename):
+        self.survey_date = survey_date
+        self.surveyors = surveyors
+        self.instrument_sn = instrument_sn
+        self.sa_version = sa_version
+        self.sa_filename = sa_filename
+
+    def values(self):
+        return [getattr(self, attr) for attr in self.__slots__]
+
+
+def read_info(filename):
+
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        rows = [row for row in csv.reader(f) if row]
+    for row in rows:
+        if len(row) != 2:
+            raise ValueError(filename + ": expected 'Key,Value' rows, got " + str(row))
+    info = dict(rows)
+    missing = [key for key in INFO_KEYS if key not in info]
+    if missing:
+        raise ValueError(filename + ": missing key(s) " + ", ".join(missing))
+
+    return SurveyInfo(*[info[key] for key in INFO_KEYS])
+
+
+def check_name(name, filename):
+
+    if len(name) > NAME_LENGTH:
+        raise ValueError(filename + ": name longer than " + str(NAME_LENGTH) + " characters " + repr(name))
+
+
+def read_poses(filename, header=True):
+
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        rows = [row for row in csv.reader(f) if row]
+    if header:
+        if not rows:
+            raise ValueError(filename + ": file is empty")
+        columns = rows[0]
+        rows = rows[1:]
+        if len(columns) != len(POSE_DTYPE):
+            raise ValueError(filename + ": expected " + str(len(POSE_DTYPE)) + " columns, got " + str(len(columns)))
+        if [label.strip() for label in columns[1:]] != POSE_LABELS:
+            raise ValueError(filename + ": expected columns " + str(POSE_LABELS) + ", got " + str(columns[1:]))
+    else:
+        columns = None
+
+    poses = np.empty(len(rows), dtype=POSE_DTYPE)
+    for i, row in enumerate(rows):
+        if len(row) != len(POSE_DTYPE):
+            raise ValueError(filename + ": row " + str(i+1) + " has " + str(len(row)) + " columns")
+        check_name(row[0], filename)
+        try:
+            poses[i] = (row[0], *[float(value) for value in row[1:]])
+        except ValueError:
+            raise ValueError(filename + ": non-numeric value in row " + str(i+1) + " " + str(row))
+
+    return poses, columns
+
+
+def read_fiducials(filename):
+
+    book = xlrd.open_workbook(filename, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        if sheet.nrows <= FIDUCIALS_FIRST_ROW or sheet.ncols <= max(FIDUCIALS_COLUMNS):
+            raise ValueError(filename + ": no point table found")
+        labels = [sheet.cell_value(FIDUCIALS_HEADER_ROW, col) for col in FIDUCIALS_COLUMNS]
+        if labels != ['Point Name','X','Y','Z']:
+            raise ValueError(filename + ": unexpected point table header " + str(labels))
+        units = [str(sheet.cell_value(FIDUCIALS_HEADER_ROW+1, col)).strip('()') for col in FIDUCIALS_COLUMNS[1:]]
+        if units != POINT_UNITS:
+            raise ValueError(filename + ": expected units " + str(POINT_UNITS) + ", got " + str(units))
+
+        rows = [[sheet.cell_value(row, col) for col in FIDUCIALS_COLUMNS]
+                for row in range(FIDUCIALS_FIRST_ROW, sheet.nrows)]
+    finally:
+        book.release_resources()
+    rows = [row for row in rows if row[0] != '']
+
+    points = np.empty(len(rows), dtype=POINT_DTYPE)
+    for i, row in enumerate(rows):
+        check_name(str(row[0]), filename)
+        try:
+            points[i] = (row[0], *[float(value) for value in row[1:]])
+        except ValueError:
+            raise ValueError(filename + ": non-numeric coordinate for point " + str(row[0]))
+
+    return points
+
+
+class SurveyDataset:
+
+    __slots__ = ("module_name","directory","info","centers","centers_columns","m1_vertex","fiducials")
+
+    def __init__(self, directory, module_name=None):
+        self.directory = directory
+        if module_name is None:
+            module_name = os.path.basename(os.path.normpath(directory))
+        self.module_name = module_name
+
+        self.info = read_info(os.path.join(directory, 'INFO.csv'))
+        self.centers, self.centers_columns = read_poses(os.path.join(directory, 'CENTERS.csv'))
+        m1_file = os.path.join(directory, 'M1_VERTEX.csv')
+        if os.path.isfile(m1_file):
+            self.m1_vertex = read_poses(m1_file, header=False)[0]
+        else:
+            self.m1_vertex = None
+        self.fiducials = read_fiducials(os.path.join(directory, 'FIDUCIALS.xls'))
+
+    @classmethod
+    def from_parts(cls, directory, module_name, info, centers, centers_columns, m1_vertex, fiducials):
+        # used by the pre-flight check, which has already parsed every file
+        dataset = cls.__new__(cls)
+        dataset.directory = directory
+        dataset.module_name = module_name
+        dataset.info = info
+        dataset.centers = centers
+        dataset.centers_columns = centers_columns
+        dataset.m1_vertex = m1_vertex
+        dataset.fiducials = fiducials
+        return dataset
+
+    def __repr__(self):
+        return "SurveyDataset(" + repr(self.module_name) + ", " + str(len(self.centers)) + " centers, " + str(len(self.fiducials)) + " fiducials)"
+
+    @staticmethod
+    def units(array):
+        if array.dtype == POSE_DTYPE:
+            return dict(zip(POSE_FIELDS, POSE_UNITS))
+        return dict(zip(POINT_FIELDS, POINT_UNITS))
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:]:
+        print(SurveyDataset(directory))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Script checks magnet module survey directories before a report is
+generated.   Every input file is validated in one cheap pass so that a bad
+directory is rejected before the template copy and the Excel stages """
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from surveyDataset import SurveyDataset, read_info, read_poses, read_fiducials
+
+REQUIRED_FILES = ['INFO.csv','CENTERS.csv','FIDUCIALS.xls','TRANSFORMS.xls','USMN.xls']
+XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'   # OLE2 compound document (Excel 97-2003)
+
+
+def check_xls_signature(filename):
+
+    with open(filename, 'rb') as f:
+        if f.read(len(XLS_SIGNATURE)) != XLS_SIGNATURE:
+            raise ValueError(filename + ": not an Excel 97-2003 .xls file")
+
+
+def preflight_check(directory, assignments=None, module_name=None):
+
+    # returns (problems, dataset); dataset is the parsed SurveyDataset, or None if there are problems
+    if module_name is None:
+        module_name = os.path.basename(os.path.normpath(directory))
+    if not os.path.isdir(directory):
+        return [directory + ": module directory not found"], None
+
+    problems = []
+    for name in REQUIRED_FILES:
+        if not os.path.isfile(os.path.join(directory, name)):
+            problems.append(os.path.join(directory, name) + ": file not found")
+
+    checks = []
+    checks.append(('INFO.csv', read_info))
+    checks.append(('CENTERS.csv', read_poses))
+    checks.append(('M1_VERTEX.csv', lambda filename: read_poses(filename, header=False)))
+    checks.append(('FIDUCIALS.xls', check_xls_signature))
+    checks.append(('FIDUCIALS.xls', read_fiducials))
+    checks.append(('TRANSFORMS.xls', check_xls_signature))
+    checks.append(('USMN.xls', check_xls_signature))
+
+    parsed = {}
+    failed = set()
+    for name, check in checks:
+        filename = os.path.join(directory, name)
+        if name in failed or not os.path.isfile(filename):
+            continue
+        try:
+            result = check(filename)
+        except ValueError as e:
+            problems.append(str(e))
+            failed.add(name)
+            continue
+        except Exception as e:
+            # xlrd raises IndexError, AssertionError etc. on truncated or corrupt files
+            problems.append(filename + ": unreadable (" + type(e).__name__ + ": " + str(e) + ")")
+            failed.add(name)
+            continue
+        if result is not None:
+            parsed[name] = result
+        if name == 'CENTERS.csv' and len(result[0]) == 0:
+            problems.append(filename + ": no magnet centers")
+        if name == 'M1_VERTEX.csv' and len(result[0]) != 1:
+            problems.append(filename + ": expected 1 row, got " + str(len(result[0])))
+
+    if assignments is not None:
+        if module_name not in assignments:
+            problems.append(module_name + ": module not found in magnet assignments")
+        elif not assignments[module_name]:
+            problems.append(module_name + ": no magnets assigned to module")
+
+    if problems:
+        return problems, None
+    centers, centers_columns = parsed['CENTERS.csv']
+    m1_vertex = parsed['M1_VERTEX.csv'][0] if 'M1_VERTEX.csv' in parsed else None
+    dataset = SurveyDataset.from_parts(directory, module_name, parsed['INFO.csv'], centers, centers_columns,
+                                       m1_vertex, parsed['FIDUCIALS.xls'])
+    return problems, dataset
+
+
+def safe_preflight_check(directory, assignments=None):
+
+    # one broken directory must not abort the rest of the batch
+    try:
+        return preflight_check(directory, assignments)
+    except Exception as e:
+        return [str(directory) + ": pre-flight check failed (" + type(e).__name__ + ": " + str(e) + ")"], None
+
+
+def preflight_batch(directories, assignments=None, max_workers=8):
+
+    # directories may be a generator, and a directory listed twice is only checked once
+    directories = list(dict.fromkeys(directories))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda directory: safe_preflight_check(directory, assignments), directories))
+    return dict(zip(directories, results))
+
+
+if __name__ == "__main__":
+    for directory, (problems, dataset) in preflight_batch(sys.argv[1:]).items():
+        print(directory + ": " + ("OK" if not problems else str(len(problems)) + " problem(s)"))
+        for problem in problems:
+            print("    " + problem)